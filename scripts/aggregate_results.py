@@ -13,30 +13,43 @@ This script scans <artifacts_dir> recursively for those fragments and appends
 new rows, skipping any already present.
   - BUSCO.tsv    dedup key: annotation_id       (one success row per annotation)
   - .retry.log   dedup key: (annotation_id, run_at)  (full history of failures)
+
+Known BUSCO.tsv annotation_ids are cached in a BUSCO.tsv.ids sidecar, kept
+in step with each append; it is rebuilt whenever BUSCO.tsv changed elsewhere.
 """
+import os
 import sys
 import csv
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 
-from utils import BUSCO_HEADER, RETRY_HEADER
+from utils import (BUSCO_HEADER, RETRY_HEADER, append_ids_index, load_ids_index,
+                   write_ids_index)
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Fragment reads are tiny and I/O-bound, so threads overlap the open/stat latency
+READ_WORKERS = 16
+# Fragment reads kept in flight, so the directory walk stays lazy
+READ_AHEAD = 4 * READ_WORKERS
+
 
 def load_existing_ids(tsv_path):
     """Return set of annotation_ids already in a TSV file."""
     p = Path(tsv_path)
     if not p.exists():
         return set()
-    ids = set()
     with open(p, newline='') as f:
-        reader = csv.DictReader(f, delimiter='\t')
-        for row in reader:
-            if row.get('annotation_id'):
-                ids.add(row['annotation_id'])
-    return ids
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader, None)
+        if not header or 'annotation_id' not in header:
+            return set()
+        idx = header.index('annotation_id')
+        return {sys.intern(row[idx]) for row in reader if len(row) > idx and row[idx]}
 
 
 def load_existing_retry_entries(tsv_path):
@@ -44,13 +57,16 @@ def load_existing_retry_entries(tsv_path):
     p = Path(tsv_path)
     if not p.exists():
         return set()
-    entries = set()
     with open(p, newline='') as f:
-        reader = csv.DictReader(f, delimiter='\t')
-        for row in reader:
-            if row.get('annotation_id') and row.get('run_at'):
-                entries.add((row['annotation_id'], row['run_at']))
-    return entries
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader, None)
+        if not header or 'annotation_id' not in header or 'run_at' not in header:
+            return set()
+        id_idx = header.index('annotation_id')
+        at_idx = header.index('run_at')
+        width = max(id_idx, at_idx)
+        return {(row[id_idx], row[at_idx]) for row in reader
+                if len(row) > width and row[id_idx] and row[at_idx]}
 
 
 def ensure_header(tsv_path, header):
@@ -65,20 +81,58 @@ def append_rows(tsv_path, rows):
     """Append a list of dicts to a TSV file (no header written)."""
     if not rows:
         return
-    with open(tsv_path, 'a', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=rows[0].keys(), delimiter='\t', lineterminator='\n')
-        writer.writerows(rows)
+    header = list(rows[0].keys())
+    values = [[str(row[k]) for k in header] for row in rows]
+    if any(c in v for r in values for v in r for c in '\t\n\r"'):
+        # Needs csv quoting — take the slow path
+        with open(tsv_path, 'a', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=header, delimiter='\t', lineterminator='\n')
+            writer.writerows(rows)
+        return
+    buf = ''.join('\t'.join(r) + '\n' for r in values)
+    with open(tsv_path, 'ab') as f:
+        f.write(buf.encode())
 
 
 def read_fragment(fragment_path, expected_header):
     """Read a fragment TSV. Returns list of row dicts matching expected_header."""
-    rows = []
     with open(fragment_path, newline='') as f:
-        reader = csv.DictReader(f, delimiter='\t')
-        for row in reader:
-            if set(expected_header).issubset(row.keys()):
-                rows.append({k: row[k] for k in expected_header})
-    return rows
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader, None)
+        if not header or not frozenset(expected_header).issubset(header):
+            return []
+        idx = [header.index(k) for k in expected_header]
+        width = max(idx)
+        return [dict(zip(expected_header, (row[i] for i in idx)))
+                for row in reader if len(row) > width]
+
+
+def iter_fragments(root, prefix):
+    """Yield paths of <prefix>*.tsv files under root, walking lazily with os.scandir."""
+    stack = [str(root)]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif (entry.name.startswith(prefix) and entry.name.endswith('.tsv')
+                      and entry.is_file()):
+                    yield entry.path
+
+
+def bounded_map(ex, fn, iterable, limit=READ_AHEAD):
+    """Like ex.map, in order, but with at most `limit` calls submitted at once.
+
+    ex.map submits every item up front, which would drain iter_fragments()
+    before the first result; this pulls from iterable only as results are consumed.
+    """
+    in_flight = deque()
+    for item in iterable:
+        if len(in_flight) >= limit:
+            yield in_flight.popleft().result()
+        in_flight.append(ex.submit(fn, item))
+    while in_flight:
+        yield in_flight.popleft().result()
 
 
 def main():
@@ -94,7 +148,11 @@ def main():
         logger.error(f"Artifacts directory not found: {artifacts_dir}")
         sys.exit(1)
 
-    existing_busco_ids   = load_existing_ids(busco_tsv)
+    # The sidecar index avoids re-parsing the whole BUSCO.tsv on every run
+    existing_busco_ids = load_ids_index(busco_tsv)
+    busco_index_fresh  = existing_busco_ids is not None
+    if not busco_index_fresh:
+        existing_busco_ids = load_existing_ids(busco_tsv)
     existing_retry_entries = load_existing_retry_entries(retry_tsv)
     logger.info(f"Existing BUSCO rows   : {len(existing_busco_ids)}")
     logger.info(f"Existing retry rows   : {len(existing_retry_entries)}")
@@ -102,34 +160,53 @@ def main():
     ensure_header(busco_tsv,   BUSCO_HEADER)
     ensure_header(retry_tsv,   RETRY_HEADER)
 
+    result_fragments = iter_fragments(artifacts_dir, "result_")
+    log_fragments    = iter_fragments(artifacts_dir, "log_")
+
+    read_busco = partial(read_fragment, expected_header=BUSCO_HEADER)
+    read_retry = partial(read_fragment, expected_header=RETRY_HEADER)
+
+    # Parse fragments concurrently; dedup below stays on the main thread
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as ex:
+        busco_rows = [row for rows in bounded_map(ex, read_busco, result_fragments) for row in rows]
+        retry_rows = [row for rows in bounded_map(ex, read_retry, log_fragments) for row in rows]
+
+    # Keep the first row per new key; discard() drops later duplicates
+    new_busco_ids = {row['annotation_id'] for row in busco_rows} - existing_busco_ids
     busco_new = []
-    retry_new = []
+    for row in busco_rows:
+        if row['annotation_id'] in new_busco_ids:
+            busco_new.append(row)
+            new_busco_ids.discard(row['annotation_id'])
 
-    result_fragments = sorted(artifacts_dir.rglob("result_*.tsv"))
-    log_fragments    = sorted(artifacts_dir.rglob("log_*.tsv"))
-
-    for frag in result_fragments:
-        rows = read_fragment(frag, BUSCO_HEADER)
-        for row in rows:
-            if row['annotation_id'] not in existing_busco_ids:
-                busco_new.append(row)
-                existing_busco_ids.add(row['annotation_id'])
-                logger.info(f"  + BUSCO: {row['annotation_id']}")
-            else:
-                logger.info(f"  ~ skip (already exists): {row['annotation_id']}")
-
-    for frag in log_fragments:
-        rows = read_fragment(frag, RETRY_HEADER)
-        for row in rows:
-            key = (row['annotation_id'], row['run_at'])
-            if key not in existing_retry_entries:
-                retry_new.append(row)
-                existing_retry_entries.add(key)
-                logger.info(f"  + retry: {row['annotation_id']} @ {row['run_at']}")
+    new_retry_keys = {(row['annotation_id'], row['run_at']) for row in retry_rows} - existing_retry_entries
+    retry_new = []
+    for row in retry_rows:
+        key = (row['annotation_id'], row['run_at'])
+        if key in new_retry_keys:
+            retry_new.append(row)
+            new_retry_keys.discard(key)
+
+    # Skipped rows are either already in the TSV or repeated within this batch
+    busco_present = sum(row['annotation_id'] in existing_busco_ids for row in busco_rows)
+    retry_present = sum((row['annotation_id'], row['run_at']) in existing_retry_entries
+                        for row in retry_rows)
+    logger.info(f"Fragments: {len(busco_rows)} BUSCO rows "
+                f"({busco_present} already present, "
+                f"{len(busco_rows) - len(busco_new) - busco_present} duplicated in batch), "
+                f"{len(retry_rows)} retry rows "
+                f"({retry_present} already present, "
+                f"{len(retry_rows) - len(retry_new) - retry_present} duplicated in batch)")
 
     append_rows(busco_tsv,   busco_new)
     append_rows(retry_tsv,   retry_new)
 
+    new_ids = [row['annotation_id'] for row in busco_new]
+    if busco_index_fresh:
+        append_ids_index(busco_tsv, new_ids)
+    else:
+        write_ids_index(busco_tsv)
+
     logger.info(f"Appended {len(busco_new)} BUSCO rows and {len(retry_new)} retry rows.")
 
 
@@ -12,8 +12,12 @@ Emits GitHub Actions outputs:
   - chunk_count   total number of chunks (N)
   - pending_count total number of pending annotations
 
+With --pending-out, also writes the ordered pending IDs (one per line) so
+run_busco_batch.py can slice them without re-reading the TSVs.
+
 Usage:
     python build_matrix.py <annotations_tsv> <busco_tsv> <retry_tsv> [--max-per-job N]
+                           [--pending-out pending.txt]
 
 Writes to $GITHUB_OUTPUT if the environment variable is set, otherwise prints
 to stdout (useful for local testing).
@@ -25,7 +29,7 @@ import argparse
 import logging
 from pathlib import Path
 
-from utils import load_ids, compute_pending_ids
+from utils import load_ids, partition_pending_ids, write_pending
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 logger = logging.getLogger(__name__)
@@ -42,6 +46,13 @@ def write_output(key, value):
         print(line)
 
 
+def write_empty_outputs():
+    """Emit outputs for an empty matrix (busco jobs will be skipped)."""
+    write_output('matrix',        '[]')
+    write_output('chunk_count',   '0')
+    write_output('pending_count', '0')
+
+
 def main():
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('annotations_tsv', help='Path to annotations.tsv')
@@ -53,6 +64,8 @@ def main():
                         help='Maximum annotations per job; limits total processed per trigger')
     parser.add_argument('--giveup-tsv', default=None,
                         help='Path to .giveup.log (given-up annotations to exclude)')
+    parser.add_argument('--pending-out', default=None,
+                        help='Write the ordered pending IDs here (one per line) for the batch jobs')
     args = parser.parse_args()
 
     all_ids     = load_ids(args.annotations_tsv)
@@ -62,39 +75,48 @@ def main():
             logger.error(f"annotations.tsv not found: {args.annotations_tsv}")
             sys.exit(1)
         logger.warning("annotations.tsv is empty — nothing to process")
-        write_output('matrix',        '[]')
-        write_output('chunk_count',   '0')
-        write_output('pending_count', '0')
+        write_empty_outputs()
         return
 
     success_ids = load_ids(args.busco_tsv)
+    if all_ids <= success_ids:
+        # Steady state: everything has a result, so the logs cannot add work
+        logger.info(f"All {len(all_ids)} annotations have BUSCO results — nothing to process")
+        if args.pending_out:
+            write_pending(args.pending_out, [])
+        write_empty_outputs()
+        return
+
     retry_ids   = load_ids(args.retry_tsv)
     giveup_ids  = load_ids(args.giveup_tsv) if args.giveup_tsv else set()
 
-    pending_ids = compute_pending_ids(all_ids, success_ids, retry_ids, giveup_ids)
-    never_run   = all_ids - success_ids - retry_ids - giveup_ids
-    failed      = (retry_ids - success_ids) & all_ids
+    never_run, failed = partition_pending_ids(all_ids, success_ids, retry_ids, giveup_ids)
+    pending_count = len(never_run) + len(failed)
+
+    # Sort once here so each matrix job only has to read and slice the list
+    if args.pending_out:
+        write_pending(args.pending_out, sorted(never_run) + sorted(failed))
 
     logger.info(f"Total annotations : {len(all_ids)}")
     logger.info(f"Successful        : {len(success_ids)}")
     logger.info(f"Given up          : {len(giveup_ids)}")
     logger.info(f"Never run         : {len(never_run)}")
     logger.info(f"Failed (retry)    : {len(failed)}")
-    logger.info(f"Pending (total)   : {len(pending_ids)}")
+    logger.info(f"Pending (total)   : {pending_count}")
 
-    if not pending_ids:
+    if not pending_count:
         logger.info("No pending annotations — matrix will be empty, busco jobs will be skipped")
         n_chunks = 0
     else:
         if args.max_per_job:
             import math
             # Only schedule what can be processed this trigger (256 * max_per_job)
-            to_process = min(args.max_chunks * args.max_per_job, len(pending_ids))
+            to_process = min(args.max_chunks * args.max_per_job, pending_count)
             n_chunks = min(args.max_chunks, math.ceil(to_process / args.max_per_job))
             logger.info(f"Annotations this trigger: {to_process} "
-                        f"({len(pending_ids) - to_process} deferred to next run)")
+                        f"({pending_count - to_process} deferred to next run)")
         else:
-            n_chunks = min(args.max_chunks, len(pending_ids))
+            n_chunks = min(args.max_chunks, pending_count)
 
     logger.info(f"Chunks to create  : {n_chunks}")
 
@@ -102,7 +124,7 @@ def main():
 
     write_output('matrix',        matrix)
     write_output('chunk_count',   str(n_chunks))
-    write_output('pending_count', str(len(pending_ids)))
+    write_output('pending_count', str(pending_count))
 
 
 if __name__ == '__main__':
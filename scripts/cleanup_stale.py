@@ -3,7 +3,8 @@
 Remove stale annotation entries from BUSCO.tsv and .retry.log.
 
 An annotation is stale when its annotation_id is no longer present in
-annotations.tsv (e.g. it was removed from the AnnoTrEive API).
+annotations.tsv (e.g. it was removed from the AnnoTrEive API). The
+BUSCO.tsv.ids sidecar is regenerated afterwards.
 
 Usage:
     python cleanup_stale.py <annotations_tsv> <busco_tsv> <retry_tsv>
@@ -13,7 +14,7 @@ import argparse
 import logging
 from pathlib import Path
 
-from utils import load_ids
+from utils import load_ids, write_ids_index
 
 logging.basicConfig(
     level=logging.INFO,
@@ -71,6 +72,7 @@ def main():
 
     removed_busco = filter_tsv(args.busco_tsv, valid_ids)
     removed_retry = filter_tsv(args.retry_tsv, valid_ids)
+    write_ids_index(args.busco_tsv)
     removed_giveup = 0
     if args.giveup_tsv:
         removed_giveup = filter_tsv(args.giveup_tsv, valid_ids)
@@ -7,6 +7,7 @@ BUSCO pipeline using the shell scripts.
 
 Usage:
     python run_busco_analysis.py <annotation_url> <assembly_url> <annotation_id> <busco_tsv> <retry_log>
+    python run_busco_analysis.py --manifest <manifest_tsv>
 
 Example:
     python run_busco_analysis.py \\
@@ -15,7 +16,9 @@ Example:
         ann123 BUSCO.tsv .retry.log
 """
 import csv
+import functools
 import logging
+import os
 import re
 import shutil
 import subprocess
@@ -23,16 +26,62 @@ import sys
 import tempfile
 import urllib.error
 import urllib.request
-from datetime import datetime
 from pathlib import Path
 
-from utils import BUSCO_HEADER, RETRY_HEADER
+from utils import BUSCO_HEADER, RETRY_HEADER, now_str
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 logger = logging.getLogger(__name__)
 
+# Patterns for the BUSCO short_summary file, e.g.
+#   The lineage dataset is: eukaryota_odb12 (...)
+#   C:95.3%[S:93.0%,D:2.3%],F:1.6%,M:3.1%,n:129
+#   129    Total BUSCO groups searched
+_LINEAGE_RE = re.compile(r"lineage dataset is: (\S+)")
+_SCORES_RE = re.compile(
+    r"C:(\d+(?:\.\d+)?)%.*?S:(\d+(?:\.\d+)?)%.*?D:(\d+(?:\.\d+)?)%"
+    r".*?F:(\d+(?:\.\d+)?)%.*?M:(\d+(?:\.\d+)?)%"
+)
+_COUNT_RE = re.compile(r"(\d+)\s+total BUSCO", re.IGNORECASE)
+
+# Same suffixes 01_extract_proteins.sh strips to build <gff_basename>
+_GFF_SUFFIX_RE = re.compile(r"(?:\.gff3?)?(?:\.gz)?$")
+
+LINEAGE_CANDIDATES = [
+    Path("assets/busco_downloads/lineages/eukaryota_odb12"),
+    Path("busco_downloads/lineages/eukaryota_odb12"),
+    Path("eukaryota_odb12"),
+]
+
+# Resolved once per process; reused by every run_one() call in a batch
+_LINEAGE_PATH = None
+
+
+def get_lineage_path():
+    """Return the first existing lineage folder in LINEAGE_CANDIDATES, or None."""
+    global _LINEAGE_PATH
+    if _LINEAGE_PATH is None:
+        _LINEAGE_PATH = next((p for p in LINEAGE_CANDIDATES if p.exists()), None)
+    return _LINEAGE_PATH
+
+
+@functools.lru_cache(maxsize=None)
+def get_pipeline_scripts():
+    """Return (extract_script, busco_script) paths, located relative to this file."""
+    script_dir = Path(__file__).resolve().parent
+    return script_dir / "01_extract_proteins.sh", script_dir / "02_run_BUSCO.sh"
+
+
+@functools.lru_cache(maxsize=None)
+def get_annocli():
+    """Return the absolute annocli path, or the bare name if it is not on PATH.
+
+    subprocess only uses posix_spawn when the executable has a directory part.
+    """
+    return shutil.which("annocli") or "annocli"
+
 
 def download_file(url, dest_path):
     """
@@ -64,6 +113,9 @@ def run_shell_script(script_path, args, step_name):
     """
     Run a shell script and return success/failure.
 
+    Output is captured as bytes; stdout is only decoded when the step fails,
+    since long BUSCO logs are discarded on success.
+
     Returns:
         tuple: (success: bool, stdout: str, stderr: str)
     """
@@ -71,19 +123,29 @@ def run_shell_script(script_path, args, step_name):
     logger.info(f"Running {step_name}: {' '.join(cmd)}")
 
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+        # close_fds=False keeps the launch on the posix_spawn fast path
+        result = subprocess.run(cmd, capture_output=True, close_fds=False, check=True)
         logger.info(f"{step_name} completed successfully")
-        return True, result.stdout, result.stderr
+        return True, "", result.stderr.decode("utf-8", "replace")
     except subprocess.CalledProcessError as e:
+        stdout = e.stdout.decode("utf-8", "replace")
+        stderr = e.stderr.decode("utf-8", "replace")
         logger.error(f"{step_name} failed with exit code {e.returncode}")
-        logger.error(f"stdout: {e.stdout}")
-        logger.error(f"stderr: {e.stderr}")
-        return False, e.stdout, e.stderr
+        logger.error(f"stdout: {stdout}")
+        logger.error(f"stderr: {stderr}")
+        return False, stdout, stderr
     except FileNotFoundError as e:
         logger.error(f"Script not found: {script_path}")
         return False, "", str(e)
 
 
+def protein_file_for(gff_file):
+    """Return the <gff_basename>_proteins.faa path 01_extract_proteins.sh writes next to gff_file."""
+    gff_file = Path(gff_file)
+    base = _GFF_SUFFIX_RE.sub("", gff_file.name, count=1)
+    return gff_file.parent / f"{base}_proteins.faa"
+
+
 def parse_busco_results(busco_output_dir):
     """
     Parse BUSCO results from the output directory.
@@ -101,8 +163,6 @@ def parse_busco_results(busco_output_dir):
     summary_file = summary_files[0]
     logger.info(f"Reading summary from {summary_file}")
 
-    content = summary_file.read_text()
-
     results: dict[str, str | float | int | None] = {
         "lineage": "",
         "busco_count": None,
@@ -113,102 +173,96 @@ def parse_busco_results(busco_output_dir):
         "missing": None,
     }
 
-    lineage_match = re.search(r"lineage dataset is: (\S+)", content)
-    complete_match = re.search(r"C:(\d+(?:\.\d+)?)%", content)
-    single_match = re.search(r"S:(\d+(?:\.\d+)?)%", content)
-    duplicated_match = re.search(r"D:(\d+(?:\.\d+)?)%", content)
-    fragmented_match = re.search(r"F:(\d+(?:\.\d+)?)%", content)
-    missing_match = re.search(r"M:(\d+(?:\.\d+)?)%", content)
-    count_match = re.search(r"(\d+)\s+total BUSCO", content, re.IGNORECASE)
-
-    if lineage_match:
-        results["lineage"] = str(lineage_match.group(1))
-    if complete_match:
-        results["complete"] = float(str(complete_match.group(1)))
-    if single_match:
-        results["single"] = float(str(single_match.group(1)))
-    if duplicated_match:
-        results["duplicated"] = float(str(duplicated_match.group(1)))
-    if fragmented_match:
-        results["fragmented"] = float(str(fragmented_match.group(1)))
-    if missing_match:
-        results["missing"] = float(str(missing_match.group(1)))
-    if count_match:
-        results["busco_count"] = int(str(count_match.group(1)))
+    # Each field sits on its own line; stop reading once all three are found
+    pending = {"lineage", "scores", "count"}
+    with open(summary_file) as f:
+        for line in f:
+            if "lineage" in pending:
+                lineage_match = _LINEAGE_RE.search(line)
+                if lineage_match:
+                    results["lineage"] = lineage_match.group(1)
+                    pending.discard("lineage")
+                    continue
+            if "scores" in pending:
+                scores_match = _SCORES_RE.search(line)
+                if scores_match:
+                    for key, value in zip(
+                        ("complete", "single", "duplicated", "fragmented", "missing"),
+                        scores_match.groups(),
+                    ):
+                        results[key] = float(value)
+                    pending.discard("scores")
+                    continue
+            if "count" in pending:
+                count_match = _COUNT_RE.search(line)
+                if count_match:
+                    results["busco_count"] = int(count_match.group(1))
+                    pending.discard("count")
+            if not pending:
+                break
 
     logger.info(f"BUSCO results: {results}")
     return results
 
 
+def append_row(path, header, row):
+    """Append one row to a TSV in a single open, writing the header first if the file is new.
+
+    Safe on both per-job fragments and the shared BUSCO.tsv / .retry.log.
+    Line-buffered so each line reaches the file as soon as it is written,
+    for anything tailing the output directory.
+    """
+    with open(path, "a", newline="", buffering=1) as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        if f.tell() == 0:
+            writer.writerows([header, row])
+        else:
+            writer.writerow(row)
+
+
 def append_to_busco_tsv(busco_file, annotation_id, results):
-    """Append successful BUSCO results to BUSCO.tsv."""
+    """Append successful BUSCO results to a result TSV (fragment or BUSCO.tsv)."""
     logger.info(f"Writing results for {annotation_id} to {busco_file}")
-    file_exists = Path(busco_file).exists()
-    with open(busco_file, "a", newline="") as f:
-        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
-        if not file_exists:
-            writer.writerow(BUSCO_HEADER)
-        writer.writerow(
-            [
-                annotation_id,
-                results["lineage"],
-                results["busco_count"] if results["busco_count"] is not None else "NA",
-                results["complete"] if results["complete"] is not None else "NA",
-                results["single"] if results["single"] is not None else "NA",
-                results["duplicated"] if results["duplicated"] is not None else "NA",
-                results["fragmented"] if results["fragmented"] is not None else "NA",
-                results["missing"] if results["missing"] is not None else "NA",
-            ]
-        )
+    append_row(
+        busco_file,
+        BUSCO_HEADER,
+        [
+            annotation_id,
+            results["lineage"],
+            results["busco_count"] if results["busco_count"] is not None else "NA",
+            results["complete"] if results["complete"] is not None else "NA",
+            results["single"] if results["single"] is not None else "NA",
+            results["duplicated"] if results["duplicated"] is not None else "NA",
+            results["fragmented"] if results["fragmented"] is not None else "NA",
+            results["missing"] if results["missing"] is not None else "NA",
+        ],
+    )
 
 
 def append_to_retry_log(retry_log, annotation_id, step):
-    """Append a failed run to .retry.log."""
+    """Append a failed run to a retry log (fragment or .retry.log)."""
     logger.info(f"Logging failure for {annotation_id} to {retry_log}")
-    file_exists = Path(retry_log).exists()
-    run_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    run_at = now_str()
     step = " ".join(step.splitlines()).strip()
-    with open(retry_log, "a", newline="") as f:
-        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
-        if not file_exists:
-            writer.writerow(RETRY_HEADER)
-        writer.writerow([annotation_id, run_at, step])
+    append_row(retry_log, RETRY_HEADER, [annotation_id, run_at, step])
 
 
-def main():
-    """Main entry point."""
-    if len(sys.argv) != 6:
-        print(
-            "Usage: python run_busco_analysis.py "
-            "<annotation_url> <assembly_url> <annotation_id> <busco_tsv> <retry_log>"
-        )
-        print()
-        print("Arguments:")
-        print("  annotation_url - URL to GFF3/GFF annotation file (can be .gz)")
-        print("  assembly_url   - URL to FASTA assembly file (can be .gz)")
-        print("  annotation_id  - Unique identifier for this annotation")
-        print("  busco_tsv      - Path to BUSCO.tsv output file")
-        print("  retry_log      - Path to .retry.log file")
-        sys.exit(1)
-
-    annotation_url = sys.argv[1]
-    assembly_url = sys.argv[2]
-    annotation_id = sys.argv[3]
-    busco_tsv = sys.argv[4]
-    retry_log = sys.argv[5]
+def run_one(annotation_url, assembly_url, annotation_id, busco_tsv, retry_log):
+    """
+    Run the full pipeline for one annotation.
 
+    Returns:
+        int: 0 on success, 1 on failure (already recorded in retry_log)
+    """
     logger.info(f"Starting BUSCO analysis for {annotation_id}")
 
-    # Locate shell scripts relative to this file
-    script_dir = Path(__file__).parent
-    extract_script = script_dir / "01_extract_proteins.sh"
-    busco_script = script_dir / "02_run_BUSCO.sh"
+    extract_script, busco_script = get_pipeline_scripts()
 
     for script in (extract_script, busco_script):
-        if not script.exists():
+        if not os.path.isfile(script):
             logger.error(f"Required script not found: {script}")
             append_to_retry_log(retry_log, annotation_id, "script_missing")
-            sys.exit(1)
+            return 1
 
     # Work inside a temp directory so downloads don't pollute the repo
     work_dir = Path(tempfile.mkdtemp(prefix=f"busco_{annotation_id}_"))
@@ -228,12 +282,12 @@ def main():
         ok, err = download_file(annotation_url, gff_file)
         if not ok:
             append_to_retry_log(retry_log, annotation_id, err)
-            sys.exit(1)
+            return 1
 
         ok, err = download_file(assembly_url, fasta_file)
         if not ok:
             append_to_retry_log(retry_log, annotation_id, err)
-            sys.exit(1)
+            return 1
 
         # ------------------------------------------------------------------
         # Step 2: Alias sequence IDs
@@ -244,7 +298,7 @@ def main():
 
         alias_gff_file = work_dir / "annotation.aliasMatch.gff3.gz"
         cmd = [
-            "annocli",
+            get_annocli(),
             "alias",
             str(gff_file),
             str(fasta_file),
@@ -254,7 +308,7 @@ def main():
         logger.info(f"Running alias_ids: {' '.join(cmd)}")
         try:
             alias_result = subprocess.run(
-                cmd, capture_output=True, text=True, check=True
+                cmd, capture_output=True, text=True, close_fds=False, check=True
             )
             logger.info("alias_ids completed successfully")
             alias_stderr = alias_result.stderr
@@ -262,21 +316,21 @@ def main():
             logger.error(f"alias_ids failed with exit code {e.returncode}")
             logger.error(f"stdout: {e.stdout}")
             logger.error(f"stderr: {e.stderr}")
-            append_to_log_tsv(
-                log_tsv, annotation_id, e.stderr if e.stderr else "alias_ids_failed"
+            append_to_retry_log(
+                retry_log, annotation_id, e.stderr if e.stderr else "alias_ids_failed"
             )
-            sys.exit(1)
+            return 1
         except FileNotFoundError as e:
             logger.error("annocli not found")
             append_to_retry_log(retry_log, annotation_id, str(e))
-            sys.exit(1)
+            return 1
 
-        if not alias_gff_file.exists():
+        if not os.path.isfile(alias_gff_file):
             logger.error(f"Expected aliasMatch file not found: {alias_gff_file}")
-            append_to_log_tsv(
-                log_tsv, annotation_id, alias_stderr if alias_stderr else "alias_output_missing"
+            append_to_retry_log(
+                retry_log, annotation_id, alias_stderr if alias_stderr else "alias_output_missing"
             )
-            sys.exit(1)
+            return 1
 
         logger.info(f"AliasMatch annotation file: {alias_gff_file}")
 
@@ -292,20 +346,18 @@ def main():
         )
 
         if not success:
-            append_to_log_tsv(
-                log_tsv, annotation_id, stderr if stderr else "extract_proteins_failed"
+            append_to_retry_log(
+                retry_log, annotation_id, stderr if stderr else "extract_proteins_failed"
             )
-            sys.exit(1)
+            return 1
 
-        # 01_extract_proteins.sh writes <gff_basename>_proteins.faa next to the gff
-        # alias_gff_file is annotation.aliasMatch.gff3.gz → basename = annotation.aliasMatch
-        protein_file = work_dir / "annotation.aliasMatch_proteins.faa"
-        if not protein_file.exists():
+        protein_file = protein_file_for(alias_gff_file)
+        if not os.path.isfile(protein_file):
             logger.error(f"Expected protein file not found: {protein_file}")
-            append_to_log_tsv(
-                log_tsv, annotation_id, stderr if stderr else "protein_file_missing"
+            append_to_retry_log(
+                retry_log, annotation_id, stderr if stderr else "protein_file_missing"
             )
-            sys.exit(1)
+            return 1
 
         logger.info(f"Protein file: {protein_file}")
 
@@ -316,19 +368,14 @@ def main():
         logger.info("STEP 4: Run BUSCO")
         logger.info("=" * 80)
 
-        lineage_candidates = [
-            Path("assets/busco_downloads/lineages/eukaryota_odb12"),
-            Path("busco_downloads/lineages/eukaryota_odb12"),
-            Path("eukaryota_odb12"),
-        ]
-        lineage_path = next((p for p in lineage_candidates if p.exists()), None)
+        lineage_path = get_lineage_path()
         if lineage_path is None:
             logger.error(
                 "Lineage folder not found. Tried: "
-                + ", ".join(str(p) for p in lineage_candidates)
+                + ", ".join(str(p) for p in LINEAGE_CANDIDATES)
             )
             append_to_retry_log(retry_log, annotation_id, "lineage_missing")
-            sys.exit(1)
+            return 1
 
         busco_output = str(work_dir / f"busco_{annotation_id}")
 
@@ -339,10 +386,10 @@ def main():
         )
 
         if not success:
-            append_to_log_tsv(
-                log_tsv, annotation_id, stderr if stderr else "busco_failed"
+            append_to_retry_log(
+                retry_log, annotation_id, stderr if stderr else "busco_failed"
             )
-            sys.exit(1)
+            return 1
 
         # ------------------------------------------------------------------
         # Step 5: Parse and record results
@@ -363,12 +410,63 @@ def main():
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         append_to_retry_log(retry_log, annotation_id, "unexpected_error")
-        sys.exit(1)
+        return 1
 
     finally:
         shutil.rmtree(work_dir, ignore_errors=True)
         logger.info(f"Cleaned up working directory: {work_dir}")
 
 
+def run_manifest(manifest_path):
+    """
+    Run run_one() for every row of a manifest TSV with columns
+    annotation_id, annotation_url, assembly_url, busco_tsv, retry_log.
+
+    Returns:
+        int: 0 if every annotation succeeded, 1 otherwise
+    """
+    failures = 0
+    with open(manifest_path, newline="") as f:
+        for row in csv.reader(f, delimiter="\t"):
+            if len(row) != 5:
+                continue
+            annotation_id, annotation_url, assembly_url, busco_tsv, retry_log = row
+            try:
+                ret = run_one(annotation_url, assembly_url, annotation_id, busco_tsv, retry_log)
+            except Exception as e:
+                # Leave a fragment for every finished row, so the batch runner
+                # can tell a row that failed from one that never started
+                logger.error(f"Unexpected error for {annotation_id}: {e}")
+                append_to_retry_log(retry_log, annotation_id, "unexpected_error")
+                ret = 1
+            failures += ret != 0
+    return 1 if failures else 0
+
+
+def main():
+    """Command-line entry point."""
+    if len(sys.argv) == 3 and sys.argv[1] == "--manifest":
+        return run_manifest(sys.argv[2])
+
+    if len(sys.argv) != 6:
+        print(
+            "Usage: python run_busco_analysis.py "
+            "<annotation_url> <assembly_url> <annotation_id> <busco_tsv> <retry_log>"
+        )
+        print("       python run_busco_analysis.py --manifest <manifest_tsv>")
+        print()
+        print("Arguments:")
+        print("  annotation_url - URL to GFF3/GFF annotation file (can be .gz)")
+        print("  assembly_url   - URL to FASTA assembly file (can be .gz)")
+        print("  annotation_id  - Unique identifier for this annotation")
+        print("  busco_tsv      - Path to BUSCO.tsv output file")
+        print("  retry_log      - Path to .retry.log file")
+        print("  manifest_tsv   - TSV of annotation_id, annotation_url, assembly_url,")
+        print("                   busco_tsv, retry_log rows, run one after another")
+        return 1
+
+    return run_one(*sys.argv[1:6])
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -12,18 +12,31 @@ Slicing: pending_sorted[chunk_index::chunk_count]
         chunk 2 of 4                        → [c,g]
         chunk 3 of 4                        → [d,h]
 
+pending_sorted is read from --pending-file (written by build_matrix.py
+--pending-out) when available, otherwise recomputed from the TSVs.
+
+With --jobs N, up to N annotations run concurrently in worker processes.
+
 Per-annotation failures are recorded in the retry TSV fragment and
 execution continues — the batch script always exits 0.
 """
 import sys
 import csv
 import argparse
-import subprocess
+import collections
+import itertools
 import logging
-from datetime import datetime
+import multiprocessing
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 
-from utils import load_ids, compute_pending_ids, RETRY_HEADER
+from run_busco_analysis import run_one
+from utils import (compute_pending_ids, iter_pending, load_ids, now_str,
+                   READ_BUFFER, RETRY_HEADER)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -31,23 +44,288 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+ANALYSIS_SCRIPT = str(Path(__file__).resolve().parent / 'run_busco_analysis.py')
+
+# All fields on the unexpected-error path are known tab/newline-free strings
+RETRY_HEADER_LINE = '\t'.join(RETRY_HEADER) + '\n'
+
+
+Annotation = collections.namedtuple('Annotation', 'annotation_url assembly_url')
+
+
+def _iter_annotation_rows(tsv_path):
+    """Yield [annotation_id, annotation_url, assembly_url] rows, skipping the header if present.
+
+    annotations.tsv has no quoting or embedded tabs, so a plain split is enough.
+    The annotation_id field comes back already stripped; URL fields do not.
+    """
+    with open(tsv_path, 'r', buffering=READ_BUFFER, newline='') as f:
+        first = True
+        for line in f:
+            s = line.rstrip('\r\n')
+            if not s:
+                continue
+            parts = s.split('\t', 3)
+            annotation_id = parts[0].strip()
+            # Header is only ever the first row; otherwise treat it as data
+            if first:
+                first = False
+                if annotation_id == 'annotation_id':
+                    continue
+            if annotation_id:
+                parts[0] = annotation_id
+                yield parts
+
+
+def load_annotation_ids(tsv_path):
+    """Return the list of annotation_ids in annotations.tsv (first pass, IDs only)."""
+    return [sys.intern(row[0]) for row in _iter_annotation_rows(tsv_path)]
 
-def load_annotations(tsv_path):
-    """Return dict of annotation_id → {annotation_url, assembly_url}."""
+
+def load_annotation_rows(tsv_path, wanted):
+    """Return dict of annotation_id → Annotation(annotation_url, assembly_url) for wanted IDs only.
+
+    Stops reading as soon as every wanted ID has been found.
+    """
     annotations = {}
-    with open(tsv_path, newline='') as f:
-        reader = csv.reader(f, delimiter='\t')
-        for row in reader:
-            if not row or not row[0].strip():
+    if not wanted:
+        return annotations
+    for row in _iter_annotation_rows(tsv_path):
+        annotation_id = row[0]
+        if annotation_id in wanted:
+            # Short rows get empty URLs rather than an IndexError
+            annotations[annotation_id] = Annotation(row[1].strip() if len(row) > 1 else '',
+                                                    row[2].strip() if len(row) > 2 else '')
+            if len(annotations) == len(wanted):
+                break
+    return annotations
+
+
+def completed_ids(output_dir):
+    """Return IDs that already have a non-empty result_<id>.tsv in output_dir."""
+    done = set()
+    with os.scandir(output_dir) as it:
+        for entry in it:
+            name = entry.name
+            if (name.startswith('result_') and name.endswith('.tsv')
+                    and entry.is_file() and entry.stat().st_size > 0):
+                done.add(name[len('result_'):-len('.tsv')])
+    return done
+
+
+# Per-process task table, set by _worker_init() (in each pool worker, or
+# in the main process when running sequentially)
+_TASKS = {}
+# Queue that pool workers report each unit to as they start it, so a broken
+# pool can tell started units from ones that never ran
+_STARTED = None
+
+
+def _worker_init(tasks, started=None):
+    """Load the chunk's task table once per worker so tasks are just annotation IDs."""
+    global _TASKS, _STARTED
+    _TASKS = tasks
+    _STARTED = started
+
+
+def _write_unexpected_error(annotation_id, log_fragment):
+    """Write an unexpected_error log fragment so the aggregator records the failure
+    and the annotation is not silently rescheduled."""
+    try:
+        run_at = now_str()
+        Path(log_fragment).write_bytes(
+            f"{RETRY_HEADER_LINE}{annotation_id}\t{run_at}\tunexpected_error\n".encode())
+    except Exception as write_err:
+        logger.error(f"  Could not write log fragment: {write_err}")
+
+
+def process_annotation(annotation_id):
+    """
+    Run the pipeline in-process for one annotation from the worker's task table.
+
+    Never raises, so one crashing annotation cannot take down a worker pool.
+
+    Returns:
+        tuple: (annotation_id, exit_code: int, error message or None)
+    """
+    if _STARTED is not None:
+        _STARTED.put(annotation_id)
+    ann, result_tsv, log_fragment = _TASKS[annotation_id]
+    logger.info(f"Processing {annotation_id}")
+    try:
+        # Called in-process to skip a Python interpreter start per annotation
+        ret = run_one(ann.annotation_url, ann.assembly_url, annotation_id,
+                      result_tsv, log_fragment)
+        return annotation_id, ret, None
+    except Exception as e:
+        _write_unexpected_error(annotation_id, log_fragment)
+        return annotation_id, 1, str(e)
+
+
+def _fragment_outcome(tasks, annotation_id):
+    """Return 0 if annotation_id has a result fragment, 1 if only a log fragment, else None."""
+    _, result_tsv, log_fragment = tasks[annotation_id]
+    if os.path.isfile(result_tsv) and os.path.getsize(result_tsv) > 0:
+        return 0
+    if os.path.isfile(log_fragment):
+        return 1
+    return None
+
+
+def _split_interrupted(tasks, annotation_ids):
+    """
+    Split annotation_ids, run in order by a process that may have died,
+    into (results, in_progress, not_run).
+
+    IDs with a fragment keep its outcome. The first ID without one was in
+    progress when the process stopped (None if every ID has a fragment);
+    the IDs after it never started.
+    """
+    results = []
+    for pos, annotation_id in enumerate(annotation_ids):
+        ret = _fragment_outcome(tasks, annotation_id)
+        if ret is None:
+            return results, annotation_id, list(annotation_ids[pos + 1:])
+        results.append((annotation_id, ret, None))
+    return results, None, []
+
+
+def _charge(tasks, annotation_id, err):
+    """Record annotation_id as failed with an unexpected_error fragment; returns its result."""
+    _write_unexpected_error(annotation_id, tasks[annotation_id][2])
+    return annotation_id, 1, err
+
+
+def _run_manifest_child(annotation_ids):
+    """Run annotation_ids in one child --manifest process. Returns (exit code, launch error)."""
+    with tempfile.NamedTemporaryFile('w', suffix='.tsv', prefix='manifest_',
+                                     newline='', delete=False) as mf:
+        writer = csv.writer(mf, delimiter='\t', lineterminator='\n')
+        for annotation_id in annotation_ids:
+            ann, result_tsv, log_fragment = _TASKS[annotation_id]
+            writer.writerow([annotation_id, ann.annotation_url, ann.assembly_url,
+                             result_tsv, log_fragment])
+    try:
+        # Keep this call posix_spawn-eligible: absolute executable, no
+        # preexec_fn/cwd/env, and close_fds=False (our fds are non-inheritable)
+        return subprocess.run([sys.executable, ANALYSIS_SCRIPT, '--manifest', mf.name],
+                              close_fds=False, check=False).returncode, None
+    except Exception as e:
+        return None, str(e)
+    finally:
+        os.unlink(mf.name)
+
+
+def process_manifest(annotation_ids):
+    """
+    Run a group of annotations in child run_busco_analysis.py --manifest processes.
+
+    Per-annotation outcomes are read back from the fragments the child writes.
+    If a child dies mid-manifest, only the annotation it was running is
+    charged an unexpected_error; the rest are run again in a fresh child.
+
+    Returns:
+        list of (annotation_id, exit_code: int, error message or None)
+    """
+    if _STARTED is not None:
+        _STARTED.put(annotation_ids)
+    logger.info(f"Processing {', '.join(annotation_ids)}")
+    results = []
+    remaining = list(annotation_ids)
+    while remaining:
+        child_ret, child_err = _run_manifest_child(remaining)
+        if child_err is not None:
+            # Nothing ran: leave these without a fragment so they stay never-run
+            results.extend((annotation_id, 1, child_err) for annotation_id in remaining)
+            break
+        # run_manifest leaves a fragment for every row it gets through, so a
+        # row without one was in progress when the child died; rows after it
+        # never started and go to a fresh child
+        done, current, remaining = _split_interrupted(_TASKS, remaining)
+        results.extend(done)
+        if current is not None:
+            results.append(_charge(_TASKS, current,
+                                   f"no fragment written (child exit {child_ret})"))
+    return results
+
+
+def run_tasks(tasks, jobs, use_subprocess=False, batch_size=8):
+    """
+    Yield (annotation_id, exit_code, error) results for every ID in tasks.
+
+    tasks maps annotation_id → (ann, result_tsv, log_fragment). With jobs > 1
+    a ProcessPoolExecutor of long-lived workers (preloaded with tasks) is fed
+    annotation IDs, and results are yielded as they complete. With
+    use_subprocess, IDs are grouped batch_size at a time into one child
+    interpreter per group.
+    """
+    if use_subprocess:
+        ids = list(tasks)
+        units = [tuple(ids[i:i + batch_size]) for i in range(0, len(ids), batch_size)]
+        worker = process_manifest
+    else:
+        units = list(tasks)
+        worker = process_annotation
+
+    if jobs <= 1:
+        _worker_init(tasks)
+        results = map(worker, units)
+        yield from (itertools.chain.from_iterable(results) if use_subprocess else results)
+        return
+    # fork reuses the already-imported modules instead of re-importing per worker
+    ctx = multiprocessing.get_context('fork' if sys.platform.startswith('linux') else None)
+    # Units that were running when a pool broke; each is rerun alone, and only
+    # one that breaks a pool on its own is charged a failure
+    suspects = []
+    while units or suspects:
+        isolated = not units
+        batch = [suspects.pop(0)] if isolated else units
+        if not isolated:
+            units = []
+        started = ctx.SimpleQueue()
+        broken = []
+        with ProcessPoolExecutor(max_workers=1 if isolated else jobs, mp_context=ctx,
+                                 initializer=_worker_init, initargs=(tasks, started)) as ex:
+            futures = {ex.submit(worker, unit): unit for unit in batch}
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken.append(futures[future])
+                    continue
+                if use_subprocess:
+                    yield from result
+                else:
+                    yield result
+        if not broken:
+            continue
+
+        # A worker died (OOM kill, segfault) and the pool went down with it.
+        # Units that never started go to a fresh pool without a give-up strike.
+        ran = set()
+        while not started.empty():
+            ran.add(started.get())
+        if ran.isdisjoint(broken):
+            # Nothing was running, so retrying would just break again
+            for unit in broken + units + suspects:
+                for annotation_id in (unit if use_subprocess else (unit,)):
+                    yield annotation_id, 1, "worker pool broke before running it"
+            return
+        for unit in broken:
+            if unit not in ran:
+                units.append(unit)
                 continue
-            # Skip header row if present
-            if row[0].strip() == 'annotation_id':
+            done, current, not_run = _split_interrupted(
+                tasks, unit if use_subprocess else (unit,))
+            yield from done
+            if not_run:
+                units.append(tuple(not_run))
+            if current is None:
                 continue
-            annotations[row[0].strip()] = {
-                'annotation_url': row[1].strip(),
-                'assembly_url':   row[2].strip(),
-            }
-    return annotations
+            if isolated:
+                yield _charge(tasks, current, "worker process died")
+            else:
+                suspects.append((current,) if use_subprocess else current)
 
 
 def main():
@@ -62,67 +340,73 @@ def main():
                         help='Cap on annotations processed by this chunk')
     parser.add_argument('--giveup-tsv',    default=None,
                         help='Path to .giveup.log (given-up annotations to exclude)')
+    parser.add_argument('--pending-file',  default=None,
+                        help='Ordered pending IDs from build_matrix.py --pending-out; '
+                             'recomputed from the TSVs if missing')
+    parser.add_argument('--jobs',          type=int, default=1,
+                        help='Annotations to run concurrently in worker processes '
+                             '(default: 1, sequential)')
+    parser.add_argument('--use-subprocess', action='store_true',
+                        help='Run annotations in separate Python processes (debugging)')
+    parser.add_argument('--batch-size',    type=int, default=8,
+                        help='With --use-subprocess, annotations per child process (default: 8)')
     args = parser.parse_args()
 
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    annotations = load_annotations(args.annotations_tsv)
-    success_ids = load_ids(args.busco_tsv)
-    retry_ids   = load_ids(args.retry_tsv)
-    giveup_ids  = load_ids(args.giveup_tsv) if args.giveup_tsv else set()
+    pending_iter = iter_pending(args.pending_file) if args.pending_file else None
+    if pending_iter is None:
+        all_ids     = load_annotation_ids(args.annotations_tsv)
+        success_ids = load_ids(args.busco_tsv)
+        retry_ids   = load_ids(args.retry_tsv)
+        giveup_ids  = load_ids(args.giveup_tsv) if args.giveup_tsv else set()
+        pending_iter = iter(compute_pending_ids(all_ids, success_ids, retry_ids, giveup_ids))
 
-    pending_ids = compute_pending_ids(set(annotations.keys()), success_ids, retry_ids, giveup_ids)
+    # Stride over the pending IDs lazily; only this chunk's slice is materialized
+    my_slice = list(itertools.islice(
+        itertools.islice(pending_iter, args.chunk_index, None, args.chunk_count),
+        args.max_per_job))
 
-    my_slice = pending_ids[args.chunk_index::args.chunk_count]
-    if args.max_per_job is not None:
-        my_slice = my_slice[:args.max_per_job]
+    # Only the URLs for this chunk's slice are kept in memory
+    annotations = load_annotation_rows(args.annotations_tsv, set(my_slice))
+    missing = [aid for aid in my_slice if aid not in annotations]
+    if missing:
+        logger.warning(f"{len(missing)} pending IDs not found in {args.annotations_tsv} "
+                       f"— skipping: {', '.join(missing)}")
+        my_slice = [aid for aid in my_slice if aid in annotations]
 
     logger.info(f"Chunk {args.chunk_index}/{args.chunk_count}: "
                 f"{len(my_slice)} annotations to process"
                 + (f" (capped at {args.max_per_job})" if args.max_per_job else ""))
 
-    script = Path(__file__).parent / 'run_busco_analysis.py'
-    succeeded  = 0
+    # A rerun into the same output_dir skips annotations that already finished
+    done = completed_ids(output_dir)
+    skipped = [aid for aid in my_slice if aid in done]
+    if skipped:
+        logger.info(f"Skipping {len(skipped)} annotations with existing results in {output_dir}")
+
+    # Fragment paths are built once here with os.path.join (cheaper than pathlib)
+    out = str(output_dir)
+    tasks = {annotation_id: (annotations[annotation_id],
+                             os.path.join(out, f"result_{annotation_id}.tsv"),
+                             os.path.join(out, f"log_{annotation_id}.tsv"))
+             for annotation_id in my_slice if annotation_id not in done}
+
+    succeeded  = len(skipped)
     fail_count = 0
 
-    for i, annotation_id in enumerate(my_slice, 1):
-        ann = annotations[annotation_id]
-        result_tsv   = str(output_dir / f"result_{annotation_id}.tsv")
-        log_fragment = str(output_dir / f"log_{annotation_id}.tsv")
-
-        logger.info(f"[{i}/{len(my_slice)}] Processing {annotation_id}")
-
-        try:
-            ret = subprocess.run(
-                [sys.executable, str(script),
-                 ann['annotation_url'],
-                 ann['assembly_url'],
-                 annotation_id,
-                 result_tsv,
-                 log_fragment],
-                check=False   # do not raise on non-zero exit
-            )
-            if ret.returncode == 0:
-                succeeded += 1
-                logger.info(f"  ✓ {annotation_id}")
-            else:
-                fail_count += 1
-                logger.warning(f"  ✗ {annotation_id} (exit {ret.returncode})")
-        except Exception as e:
+    results = run_tasks(tasks, args.jobs, args.use_subprocess, args.batch_size)
+    for i, (annotation_id, ret, err) in enumerate(results, 1):
+        if err is not None:
+            fail_count += 1
+            logger.error(f"[{i}/{len(tasks)}] ✗ {annotation_id} — unexpected error: {err}")
+        elif ret == 0:
+            succeeded += 1
+            logger.info(f"[{i}/{len(tasks)}] ✓ {annotation_id}")
+        else:
             fail_count += 1
-            logger.error(f"  ✗ {annotation_id} — unexpected error: {e}")
-            # Write a log fragment so the aggregator records this failure
-            # and the annotation is not silently rescheduled
-            try:
-                with open(log_fragment, 'w', newline='') as lf:
-                    w = csv.writer(lf, delimiter='\t', lineterminator='\n')
-                    w.writerow(RETRY_HEADER)
-                    w.writerow([annotation_id,
-                                datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                                'unexpected_error'])
-            except Exception as write_err:
-                logger.error(f"  Could not write log fragment: {write_err}")
+            logger.warning(f"[{i}/{len(tasks)}] ✗ {annotation_id} (exit {ret})")
 
     logger.info(f"Chunk {args.chunk_index} complete: "
                 f"{succeeded} succeeded, {fail_count} failed out of {len(my_slice)}")
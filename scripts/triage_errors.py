@@ -27,13 +27,16 @@ def load_existing_giveup_entries(tsv_path):
     p = Path(tsv_path)
     if not p.exists():
         return set()
-    entries = set()
     with open(p, newline='') as f:
-        reader = csv.DictReader(f, delimiter='\t')
-        for row in reader:
-            if row.get('annotation_id') and row.get('run_at'):
-                entries.add((row['annotation_id'], row['run_at']))
-    return entries
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader, None)
+        if not header or 'annotation_id' not in header or 'run_at' not in header:
+            return set()
+        id_idx = header.index('annotation_id')
+        at_idx = header.index('run_at')
+        width = max(id_idx, at_idx)
+        return {(row[id_idx], row[at_idx]) for row in reader
+                if len(row) > width and row[id_idx] and row[at_idx]}
 
 
 def ensure_header(tsv_path, header):
@@ -58,14 +61,27 @@ def main():
         logger.info(f"{retry_tsv} not found — nothing to triage")
         return
 
-    # Read all retry rows, grouped by annotation_id
+    # Read all retry rows as lists in RETRY_HEADER order, grouped by annotation_id
     groups = defaultdict(list)
     with open(retry_path, newline='') as f:
-        reader = csv.DictReader(f, delimiter='\t')
+        reader = csv.reader(f, delimiter='\t')
+        header = next(reader, None)
+        if header is None:
+            logger.info(".retry.log is empty — nothing to triage")
+            return
+        missing = [col for col in RETRY_HEADER if col not in header]
+        if missing:
+            logger.error(f"{retry_tsv} is missing columns: {', '.join(missing)}")
+            sys.exit(1)
+        idx = [header.index(col) for col in RETRY_HEADER]
+        width = max(idx)
         for row in reader:
-            aid = row.get('annotation_id', '').strip()
+            # Pad short rows like DictReader did, so the rewrite below keeps them
+            if len(row) <= width:
+                row = row + [''] * (width + 1 - len(row))
+            aid = row[idx[0]].strip()
             if aid:
-                groups[aid].append(row)
+                groups[aid].append([row[i] for i in idx])
 
     if not groups:
         logger.info(".retry.log is empty — nothing to triage")
@@ -97,13 +113,12 @@ def main():
     existing_giveup = load_existing_giveup_entries(giveup_tsv)
     ensure_header(giveup_tsv, GIVEUP_HEADER)
 
-    new_giveup = [r for r in giveup_rows
-                  if (r['annotation_id'], r['run_at']) not in existing_giveup]
+    # Rows are [annotation_id, run_at, step]; GIVEUP_HEADER == RETRY_HEADER
+    new_giveup = [r for r in giveup_rows if (r[0], r[1]) not in existing_giveup]
 
     if new_giveup:
         with open(giveup_tsv, 'a', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=GIVEUP_HEADER,
-                                    delimiter='\t', lineterminator='\n')
+            writer = csv.writer(f, delimiter='\t', lineterminator='\n')
             writer.writerows(new_giveup)
         logger.info(f"Appended {len(new_giveup)} new rows to {giveup_tsv}")
 
@@ -111,8 +126,7 @@ def main():
     with open(retry_path, 'w', newline='') as f:
         writer = csv.writer(f, delimiter='\t', lineterminator='\n')
         writer.writerow(RETRY_HEADER)
-        for row in keep_rows:
-            writer.writerow([row[col] for col in RETRY_HEADER])
+        writer.writerows(keep_rows)
 
     logger.info("Triage complete")
 
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 """Shared utilities for BUSCO-tracker scripts."""
-import csv
 import logging
+import os
+import sys
+from time import localtime, strftime
 from pathlib import Path
 
 logger = logging.getLogger(__name__)
@@ -11,38 +13,183 @@ BUSCO_HEADER = ['annotation_id', 'lineage', 'busco_count', 'complete',
 RETRY_HEADER = ['annotation_id', 'run_at', 'step']
 GIVEUP_HEADER = RETRY_HEADER
 
+# Large read buffer for the ID/annotation TSVs, which grow to many MB
+READ_BUFFER = 1 << 20
 
-def compute_pending_ids(all_ids, success_ids, error_ids, giveup_ids=None):
-    """Return pending IDs in priority order: never-run first, then failed retries."""
+
+def now_str():
+    """Return the local time as 'YYYY-MM-DD HH:MM:SS' (the run_at format)."""
+    return strftime('%Y-%m-%d %H:%M:%S', localtime())
+
+
+def partition_pending_ids(all_ids, success_ids, error_ids, giveup_ids=None):
+    """Return (never_run, failed) sets of pending IDs. The two sets are disjoint.
+
+    all_ids may be any iterable; it is streamed once rather than copied into
+    intermediate set differences, so only the pending IDs are materialized.
+    """
     if giveup_ids is None:
         giveup_ids = set()
-    never_run = all_ids - success_ids - error_ids - giveup_ids
-    failed    = (error_ids - success_ids) & all_ids
+    never_run = set()
+    failed    = set()
+    for aid in all_ids:
+        if aid in success_ids:
+            continue
+        if aid in error_ids:
+            failed.add(aid)
+        elif aid not in giveup_ids:
+            never_run.add(aid)
+    return never_run, failed
+
+
+def compute_pending_ids(all_ids, success_ids, error_ids, giveup_ids=None):
+    """Return pending IDs in priority order: never-run first, then failed retries."""
+    never_run, failed = partition_pending_ids(all_ids, success_ids, error_ids, giveup_ids)
     return sorted(never_run) + sorted(failed)
 
 
+def write_pending(path, pending_ids):
+    """Write pending IDs to a text file, one per line, preserving order."""
+    with open(path, 'w') as f:
+        f.writelines(f"{aid}\n" for aid in pending_ids)
+
+
+def iter_pending(path):
+    """Return a lazy iterator over the pending IDs written by write_pending, or None if missing."""
+    p = Path(path)
+    if not p.exists():
+        logger.info(f"{path} not found — recomputing pending IDs")
+        return None
+
+    def _lines():
+        with open(p) as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if line:
+                    yield line
+
+    return _lines()
+
+
+def _count_data_rows(p):
+    """Count the lines of a TSV after its annotation_id header, without parsing them."""
+    with open(p, 'rb', buffering=READ_BUFFER) as f:
+        first = f.readline()
+        if not first:
+            return 0
+        newlines = first.count(b'\n')
+        last = first[-1:]
+        for chunk in iter(lambda: f.read(READ_BUFFER), b''):
+            newlines += chunk.count(b'\n')
+            last = chunk[-1:]
+    has_header = first.split(b'\t', 1)[0].strip() == b'annotation_id'
+    return newlines + (last != b'\n') - has_header
+
+
+def load_ids_index(tsv_path):
+    """Return annotation_ids from the <tsv>.ids sidecar, or None if missing or stale.
+
+    The sidecar lists the TSV's annotation_ids one per line in row order, so
+    it changes line-for-line with the TSV and merges the same way on a git
+    rebase. It counts as stale when its line count differs from the TSV's
+    data row count.
+    """
+    p = Path(tsv_path)
+    index = Path(f"{tsv_path}.ids")
+    if not p.exists() or not index.exists():
+        return None
+    with open(index) as f:
+        lines = f.read().splitlines()
+    if len(lines) != _count_data_rows(p):
+        logger.info(f"{index} is stale — ignoring it")
+        return None
+    return {sys.intern(aid) for aid in lines if aid}
+
+
+def write_ids_index(tsv_path):
+    """Rewrite the <tsv>.ids sidecar from the TSV, one annotation_id per data row."""
+    p = Path(tsv_path)
+    if not p.exists():
+        return
+    with open(p, 'r', buffering=READ_BUFFER, newline='') as f, \
+            open(f"{tsv_path}.ids", 'w') as out:
+        first = f.readline()
+        if not first:
+            return
+        first_id = first.split('\t', 1)[0].strip()
+        if first_id != 'annotation_id':
+            out.write(f"{first_id}\n")
+        for line in f:
+            aid = line.split('\t', 1)[0].strip()
+            out.write(f"{aid}\n")
+
+
+def append_ids_index(tsv_path, new_ids):
+    """Append new_ids, in the order their rows were appended to the TSV, to a fresh sidecar."""
+    with open(f"{tsv_path}.ids", 'a') as f:
+        f.writelines(f"{aid}\n" for aid in new_ids)
+
+
 def load_ids(tsv_path, column='annotation_id'):
-    """Return set of values from a TSV column. Returns empty set if file missing."""
+    """Return set of values from a TSV column. Returns empty set if file missing.
+
+    Values are interned so IDs shared across files are a single str object.
+    annotation_id sets come from the <tsv>.ids sidecar when it is fresh.
+    """
     p = Path(tsv_path)
     if not p.exists():
         logger.info(f"{tsv_path} not found — treating as empty")
         return set()
+    if column == 'annotation_id':
+        ids = load_ids_index(p)
+        if ids is not None:
+            return ids
+    return _parse_ids(p, column)
+
+
+def _parse_ids(p, column):
+    """Parse the ID set for load_ids."""
+    # Imported here, not at module level, so scripts that never parse IDs
+    # (e.g. the run_busco_analysis.py --manifest child) skip the import cost
+    try:
+        import pyarrow as pa
+    except ImportError:  # optional; fall back to the plain-Python parser
+        pa = None
+    if pa is not None:
+        try:
+            return _parse_ids_arrow(p, column)
+        except pa.ArrowInvalid as e:
+            logger.debug(f"pyarrow could not parse {p} ({e}) — using plain parser")
     ids = set()
-    with open(p, newline='') as f:
+    with open(p, 'r', buffering=READ_BUFFER, newline='') as f:
         first_line = f.readline()
         if not first_line:
             return ids
-        f.seek(0)
-        has_header = first_line.split('\t')[0].strip() == column
-        if has_header:
-            reader = csv.DictReader(f, delimiter='\t')
-            for row in reader:
-                if row.get(column):
-                    ids.add(row[column])
-        else:
-            reader = csv.reader(f, delimiter='\t')
-            for row in reader:
-                if row and row[0].strip():
-                    ids.add(row[0].strip())
+        # Only column 0 is ever read, so a plain split is enough; the first
+        # line is consumed once here and counted unless it is the header
+        first = first_line.split('\t', 1)[0].strip()
+        if first and first != column:
+            ids.add(sys.intern(first))
+        for line in f:
+            value = line.split('\t', 1)[0].strip()
+            if value:
+                ids.add(sys.intern(value))
     return ids
 
+
+def _parse_ids_arrow(p, column):
+    """pyarrow variant of _parse_ids: reads only the first column, multi-threaded."""
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+    table = pacsv.read_csv(
+        p,
+        read_options=pacsv.ReadOptions(autogenerate_column_names=True),
+        parse_options=pacsv.ParseOptions(delimiter='\t', quote_char=False),
+        convert_options=pacsv.ConvertOptions(include_columns=['f0'],
+                                             column_types={'f0': pa.string()}),
+    )
+    values = table.column(0).to_pylist()
+    if values and (values[0] or '').strip() == column:
+        values = values[1:]
+    return {sys.intern(v) for v in (s.strip() for s in values if s) if v}
+